@@ -1,11 +1,21 @@
-import json
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field, fields, replace
 from enum import Enum
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 from datetime import date, datetime
+import atexit
+import bisect
+import logging
+import os
+import threading
+import time
+import numpy as np
+import orjson
+import pandas as pd
 import streamlit as st
 
+logger = logging.getLogger(__name__)
+
 
 # ==========================
 #  MODELOS (equivalentes ao types.ts)
@@ -46,7 +56,7 @@ class LeaveType(str, Enum):
     DISPENSA_RECOMPENSA = "DISPENSA RECOMPENSA"
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Personnel:
     id: str
     ant: int
@@ -63,7 +73,7 @@ class Personnel:
     role: str  # ADMIN | MANAGER | USER
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class LeaveRecord:
     id: str
     personnel_id: str
@@ -74,10 +84,124 @@ class LeaveRecord:
     createdAt: str  # ISO datetime
 
 
+def _attach_from_dict(cls):
+    """
+    Gera, uma única vez, um construtor posicional `cls.from_dict(d)`
+    a partir dos campos do dataclass, evitando o custo de `cls(**d)`.
+    """
+    args = ", ".join(f"d[{f.name!r}]" for f in fields(cls))
+    src = f"def from_dict(cls, d):\n    return cls({args})\n"
+    namespace: Dict[str, Any] = {}
+    exec(src, namespace)
+    cls.from_dict = classmethod(namespace["from_dict"])
+    return cls
+
+
+_attach_from_dict(Personnel)
+_attach_from_dict(LeaveRecord)
+
+
+def _max_id_number(prefix: str, ids: Iterable[str]) -> int:
+    numbers = [
+        int(i[len(prefix):]) for i in ids
+        if i.startswith(prefix) and i[len(prefix):].isdigit()
+    ]
+    return max(numbers, default=0)
+
+
+def _start_key(l: LeaveRecord) -> str:
+    return l.startDate
+
+
+def _created_key(l: LeaveRecord) -> str:
+    return l.createdAt
+
+
+_NO_INTERVALS = np.empty(0, dtype=np.int32)
+
+
+def _leave_ordinals(l: LeaveRecord) -> Tuple[int, int]:
+    return (
+        date.fromisoformat(l.startDate).toordinal(),
+        date.fromisoformat(l.endDate).toordinal(),
+    )
+
+
+def _search_entry(p: Personnel) -> Tuple[str, str, str]:
+    return (p.id, p.nome.casefold(), p.matr.casefold())
+
+
 @dataclass
 class AppState:
     personnel: List[Personnel]
     leaves: List[LeaveRecord]
+    # Últimos números usados nos IDs (P1, P2... / L1, L2...)
+    next_personnel_id: int = 0
+    next_leave_id: int = 0
+    # Índices em memória (não persistidos), mantidos por add_personnel/add_leave
+    # Versões dos dados, incrementadas a cada alteração; os caches guardam a
+    # versão de que dependem
+    _personnel_version: int = field(default=0, init=False, repr=False)
+    _leaves_version: int = field(default=0, init=False, repr=False)
+    _by_id: Dict[str, Personnel] = field(default_factory=dict, init=False, repr=False)
+    # Posição de cada id em `personnel` (e em `_search_index`)
+    _pos_by_id: Dict[str, int] = field(default_factory=dict, init=False, repr=False)
+    # Por militar, ordenados por startDate
+    _leaves_by_person: Dict[str, List[LeaveRecord]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    # Todos os afastamentos ordenados por createdAt
+    _leaves_by_created: List[LeaveRecord] = field(
+        default_factory=list, init=False, repr=False
+    )
+    # (id, nome, matrícula) já em casefold, para a busca do efetivo
+    _search_index: List[Tuple[str, str, str]] = field(
+        default_factory=list, init=False, repr=False
+    )
+    # Por tipo: (inícios, términos) como ordinais de data, ordenados pelo início
+    _intervals_by_type: Dict[str, Tuple[np.ndarray, np.ndarray]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    # Tabela do efetivo já montada para exibição (reconstruída sob demanda)
+    _personnel_df: Optional[pd.DataFrame] = field(default=None, init=False, repr=False)
+    _personnel_df_version: int = field(default=-1, init=False, repr=False)
+    # Militares incluídos/alterados nesta sessão e ainda não gravados
+    _dirty: Dict[str, Personnel] = field(default_factory=dict, init=False, repr=False)
+    # JSON de exportação já gerado, com as versões (efetivo, afastamentos) usadas
+    _export_cache: Optional[Tuple[Tuple[int, int], bytes]] = field(
+        default=None, init=False, repr=False
+    )
+
+    def __post_init__(self) -> None:
+        self._by_id = {p.id: p for p in self.personnel}
+        self._pos_by_id = {p.id: i for i, p in enumerate(self.personnel)}
+        self._search_index = [_search_entry(p) for p in self.personnel]
+        for l in sorted(self.leaves, key=_start_key):
+            self._leaves_by_person.setdefault(l.personnel_id, []).append(l)
+        self._leaves_by_created = sorted(self.leaves, key=_created_key)
+
+        # Cada data é convertida uma única vez; a ordenação é feita pelo NumPy
+        by_type: Dict[str, Tuple[List[int], List[int]]] = {}
+        for l in self.leaves:
+            starts, ends = by_type.setdefault(l.type, ([], []))
+            start, end = _leave_ordinals(l)
+            starts.append(start)
+            ends.append(end)
+        for t, (starts, ends) in by_type.items():
+            start_arr = np.array(starts, dtype=np.int32)
+            order = np.argsort(start_arr, kind="stable")
+            self._intervals_by_type[t] = (
+                start_arr[order], np.array(ends, dtype=np.int32)[order]
+            )
+
+        # Garante que os contadores nunca reutilizem um ID já existente
+        # (arquivos antigos não têm contador; o JSONL pode estar à frente do JSON)
+        self.next_personnel_id = max(
+            self.next_personnel_id, _max_id_number("P", self._by_id)
+        )
+        self.next_leave_id = max(
+            self.next_leave_id, _max_id_number("L", (l.id for l in self.leaves))
+        )
 
 
 # ==========================
@@ -85,82 +209,401 @@ class AppState:
 # ==========================
 
 DATA_FILE = Path("dados_efetivo.json")
+# Afastamentos ficam num arquivo só de acréscimo (um JSON por linha),
+# assim lançar um afastamento não reescreve o arquivo inteiro.
+LEAVES_FILE = Path("dados_leaves.jsonl")
 
 
-def default_state() -> AppState:
-    # Começa vazio, você pode depois criar um script para importar da planilha
-    return AppState(personnel=[], leaves=[])
+def _write_atomic(path: Path, data: bytes) -> None:
+    # Grava num temporário e troca de uma vez: uma queda no meio da gravação
+    # nunca deixa o arquivo de destino truncado.
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _repair_leaves_tail() -> None:
+    """
+    Uma queda durante append_leave_record pode deixar a última linha incompleta
+    (sem o "\n" final). Se ela ainda for um JSON válido, só completa a linha;
+    senão, descarta-a para que o próximo acréscimo comece numa linha nova.
+    """
+    # Verificação só de leitura; o arquivo só é aberto para escrita se
+    # realmente houver o que reparar.
+    with LEAVES_FILE.open("rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+
+    with LEAVES_FILE.open("r+b") as f:
+        data = f.read()
+        cut = data.rfind(b"\n") + 1
+        try:
+            orjson.loads(data[cut:])
+        except orjson.JSONDecodeError:
+            f.truncate(cut)
+        else:
+            f.write(b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# Os arquivos lidos ficam em cache compartilhado entre as sessões; a data de
+# modificação e o tamanho entram na chave, então qualquer gravação invalida o
+# cache. cache_resource devolve o mesmo objeto a todas as sessões (sem cópia),
+# por isso o resultado é só lido, nunca alterado. Só a leitura mais recente é
+# mantida, para as versões antigas não acumularem memória.
+def _file_key(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _load_raw(path: str, key: Tuple[int, int]) -> Dict[str, Any]:
+    return orjson.loads(Path(path).read_bytes())
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _load_leaves_raw(path: str, key: Tuple[int, int]) -> List[Dict[str, Any]]:
+    with Path(path).open("rb") as f:
+        return [orjson.loads(line) for line in f if line.strip()]
+
+
+def _read_raw() -> Dict[str, Any]:
+    if not DATA_FILE.exists():
+        return {}
+    return _load_raw(str(DATA_FILE), _file_key(DATA_FILE))
+
+
+def _read_leaves_raw() -> List[Dict[str, Any]]:
+    if not LEAVES_FILE.exists():
+        return []
+
+    # Sob o lock: o reparo não pode ver pela metade um acréscimo em andamento
+    with _shared_data().lock:
+        _repair_leaves_tail()
+        return _load_leaves_raw(str(LEAVES_FILE), _file_key(LEAVES_FILE))
+
+
+def load_leaves() -> List[LeaveRecord]:
+    return [LeaveRecord.from_dict(l) for l in _read_leaves_raw()]
+
+
+def append_leave_record(leave: LeaveRecord) -> None:
+    with _shared_data().lock, LEAVES_FILE.open("ab") as f:
+        f.write(orjson.dumps(leave) + b"\n")
 
 
 def load_state() -> AppState:
     if not DATA_FILE.exists():
-        return default_state()
+        return AppState(personnel=[], leaves=load_leaves())
+
+    raw = _load_raw(str(DATA_FILE), _file_key(DATA_FILE))
+
+    personnel = [Personnel.from_dict(p) for p in raw.get("personnel", [])]
+
+    # Formato antigo: afastamentos dentro do JSON principal -> migra para o JSONL
+    if "leaves" in raw and not LEAVES_FILE.exists():
+        _write_atomic(
+            LEAVES_FILE, b"".join(orjson.dumps(l) + b"\n" for l in raw["leaves"])
+        )
+
+    return AppState(
+        personnel=personnel,
+        leaves=load_leaves(),
+        next_personnel_id=raw.get("next_personnel_id", 0),
+        next_leave_id=raw.get("next_leave_id", 0),
+    )
+
+
+class _SharedData:
+    """Estado comum a todas as sessões do processo."""
+
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        # Último número de ID entregue por prefixo ("P", "L")
+        self.last_ids: Dict[str, int] = {}
+
+
+# O script é reexecutado a cada interação; cache_resource garante uma única
+# instância por processo.
+@st.cache_resource
+def _shared_data() -> _SharedData:
+    return _SharedData()
+
+
+def _max_id_on_disk(prefix: str) -> int:
+    raw = _read_raw()
+    if prefix == "P":
+        return max(
+            raw.get("next_personnel_id", 0),
+            _max_id_number("P", (p["id"] for p in raw.get("personnel", []))),
+        )
+    return max(
+        raw.get("next_leave_id", 0),
+        _max_id_number("L", (l["id"] for l in _read_leaves_raw())),
+    )
+
+
+def _allocate_number(prefix: str, floor: int) -> int:
+    """
+    Próximo número de ID para o prefixo, único entre todas as sessões: considera
+    o que já foi entregue neste processo (ainda que não gravado) e os arquivos.
+    """
+    shared = _shared_data()
+    with shared.lock:
+        n = max(shared.last_ids.get(prefix, 0), floor, _max_id_on_disk(prefix)) + 1
+        shared.last_ids[prefix] = n
+        return n
+
+
+def new_personnel_id(state: AppState) -> str:
+    state.next_personnel_id = _allocate_number("P", state.next_personnel_id)
+    return f"P{state.next_personnel_id}"
 
-    with DATA_FILE.open("r", encoding="utf-8") as f:
-        raw = json.load(f)
 
-    personnel = [Personnel(**p) for p in raw.get("personnel", [])]
-    leaves = [LeaveRecord(**l) for l in raw.get("leaves", [])]
-    return AppState(personnel=personnel, leaves=leaves)
+def new_leave_id(state: AppState) -> str:
+    state.next_leave_id = _allocate_number("L", state.next_leave_id)
+    return f"L{state.next_leave_id}"
 
 
 def save_state(state: AppState) -> None:
-    raw = {
-        "personnel": [asdict(p) for p in state.personnel],
-        "leaves": [asdict(l) for l in state.leaves],
-    }
-    with DATA_FILE.open("w", encoding="utf-8") as f:
-        json.dump(raw, f, ensure_ascii=False, indent=2)
+    """
+    Regrava apenas o efetivo; afastamentos são gravados por append_leave_record.
+
+    Várias sessões gravam o mesmo arquivo, então a gravação não é um retrato da
+    sessão: relê o arquivo (sob o lock do processo) e aplica por cima só os
+    militares que esta sessão incluiu ou alterou.
+    """
+    with _shared_data().lock:
+        disk = _read_raw()
+        written = dict(state._dirty)
+        new = dict(written)
+        personnel: List[Any] = []
+        for p in disk.get("personnel", []):
+            # Registros de outras sessões seguem como estão no disco (dict)
+            personnel.append(new.pop(p["id"], p))
+        personnel.extend(new.values())
+
+        # orjson serializa os dataclasses diretamente (em C), sem conversão para dict
+        raw = {
+            "next_personnel_id": max(
+                state.next_personnel_id, disk.get("next_personnel_id", 0)
+            ),
+            "next_leave_id": max(state.next_leave_id, disk.get("next_leave_id", 0)),
+            "personnel": personnel,
+        }
+        _write_atomic(DATA_FILE, orjson.dumps(raw))
+
+        for pid, p in list(state._dirty.items()):
+            # Só limpa o que foi gravado; uma alteração feita durante a
+            # gravação continua pendente
+            if p is written.get(pid):
+                del state._dirty[pid]
+
+
+# Gravações do efetivo são agrupadas: cada ação só agenda a gravação e uma
+# thread única escreve o estado mais recente após um pequeno intervalo.
+SAVE_DEBOUNCE_SECONDS = 0.2
+# Intervalo até nova tentativa quando uma gravação falha (disco cheio etc.)
+SAVE_RETRY_SECONDS = 5.0
+
+
+class _StateSaver:
+    def __init__(self) -> None:
+        self._pending = threading.Event()
+        self._lock = threading.Lock()        # protege _state
+        self._write_lock = threading.Lock()  # uma gravação por vez
+        self._state: Optional[AppState] = None
+        self.last_error: Optional[Exception] = None
+        self._thread = threading.Thread(target=self._run, name="state-saver", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def request(self, state: AppState) -> None:
+        with self._lock:
+            self._state = state
+            self._pending.set()
+
+    def flush(self) -> None:
+        """Grava já o estado pendente; em caso de erro ele continua pendente."""
+        with self._write_lock:
+            with self._lock:
+                state, self._state = self._state, None
+                self._pending.clear()
+            if state is None:
+                return
+            try:
+                save_state(state)
+            except Exception as e:
+                with self._lock:
+                    # Não sobrescreve um estado mais novo pedido nesse meio tempo
+                    if self._state is None:
+                        self._state = state
+                    self._pending.set()
+                self.last_error = e
+                raise
+            self.last_error = None
+
+    def _run(self) -> None:
+        while True:
+            self._pending.wait()
+            time.sleep(SAVE_DEBOUNCE_SECONDS)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception(
+                    "Falha ao gravar %s; nova tentativa em %.0f s",
+                    DATA_FILE, SAVE_RETRY_SECONDS,
+                )
+                time.sleep(SAVE_RETRY_SECONDS)
+
+
+# O script é reexecutado a cada interação; cache_resource garante uma única
+# thread de gravação por processo.
+@st.cache_resource
+def _state_saver() -> _StateSaver:
+    return _StateSaver()
+
+
+def request_save(state: AppState) -> None:
+    _state_saver().request(state)
+
+
+def export_state(state: AppState) -> bytes:
+    """
+    JSON completo e indentado (efetivo + afastamentos), para exportação.
+    Só é gerado de novo quando os dados mudam.
+    """
+    version = (state._personnel_version, state._leaves_version)
+    if state._export_cache is None or state._export_cache[0] != version:
+        raw = {
+            "personnel": state.personnel,
+            "leaves": state.leaves,
+        }
+        # orjson já grava UTF-8 (equivalente a ensure_ascii=False)
+        state._export_cache = (version, orjson.dumps(raw, option=orjson.OPT_INDENT_2))
+    return state._export_cache[1]
 
 
 # ==========================
 #  FUNÇÕES AUXILIARES
 # ==========================
 
-def generate_id(prefix: str, elements: List[Any]) -> str:
+def find_person_by_id(state: AppState, pid: str) -> Optional[Personnel]:
+    return state._by_id.get(pid)
+
+
+def get_leaves_for_person(state: AppState, pid: str) -> List[LeaveRecord]:
+    """Afastamentos do militar, já ordenados por data de início (crescente)."""
+    return state._leaves_by_person.get(pid, [])
+
+
+def leave_intervals(state: AppState, tipo: str) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Gera um ID simples com base na quantidade de elementos existentes.
-    Ex: prefix='P' -> P1, P2...
+    Retorna (inícios, términos) dos afastamentos do tipo como `date.toordinal()`,
+    em arrays paralelos ordenados pelo início.
     """
-    return f"{prefix}{len(elements) + 1}"
+    return state._intervals_by_type.get(tipo, (_NO_INTERVALS, _NO_INTERVALS))
+
+
+def personnel_dataframe(state: AppState) -> pd.DataFrame:
+    """Tabela do efetivo em colunas; só é refeita quando o efetivo muda."""
+    if state._personnel_df_version != state._personnel_version:
+        ps = state.personnel
+        state._personnel_df = pd.DataFrame({
+            "ID": [p.id for p in ps],
+            "Ant": [p.ant for p in ps],
+            "Grad": [p.grad for p in ps],
+            "Nome": [p.nome for p in ps],
+            "Matr": [p.matr for p in ps],
+            "Unid": [p.unid for p in ps],
+            "Seção": [p.secao for p in ps],
+            "Situação": [p.situacao for p in ps],
+            "Escala": [p.esc for p in ps],
+            "Saldo Férias": [p.saldoFerias for p in ps],
+            "Saldo Abono": [p.saldoAbono for p in ps],
+            "Perfil": [p.role for p in ps],
+        })
+        state._personnel_df_version = state._personnel_version
+    return state._personnel_df
 
 
-def find_person_by_id(state: AppState, pid: str) -> Optional[Personnel]:
-    for p in state.personnel:
-        if p.id == pid:
-            return p
-    return None
+def add_personnel(state: AppState, person: Personnel) -> None:
+    state._pos_by_id[person.id] = len(state.personnel)
+    state.personnel.append(person)
+    state._by_id[person.id] = person
+    state._search_index.append(_search_entry(person))
+    state._dirty[person.id] = person
+    state._personnel_version += 1
 
 
-def get_leaves_for_person(state: AppState, pid: str) -> List[LeaveRecord]:
-    return [l for l in state.leaves if l.personnel_id == pid]
+def update_personnel(state: AppState, person: Personnel, **changes: Any) -> Personnel:
+    """Registros são imutáveis: cria a versão alterada e a coloca no lugar da antiga."""
+    updated = replace(person, **changes)
+    i = state._pos_by_id[person.id]
+    state.personnel[i] = updated
+    state._search_index[i] = _search_entry(updated)
+    state._by_id[updated.id] = updated
+    state._dirty[updated.id] = updated
+    state._personnel_version += 1
+    return updated
+
+
+def debit_balance(state: AppState, person: Personnel, saldo: str, days: int) -> Personnel:
+    """
+    Desconta `days` do saldo (`saldoFerias`/`saldoAbono`) e grava na hora.
+    O desconto parte do saldo que está no disco, não do carregado na sessão,
+    para não desfazer descontos feitos por outras sessões.
+    """
+    with _shared_data().lock:
+        base = getattr(person, saldo)
+        for p in _read_raw().get("personnel", []):
+            if p["id"] == person.id:
+                base = p[saldo]
+                break
+        updated = update_personnel(state, person, **{saldo: max(0, base - days)})
+        save_state(state)
+    return updated
+
+
+def add_leave(state: AppState, leave: LeaveRecord) -> None:
+    state.leaves.append(leave)
+    # Inserção ordenada: as listas nunca precisam ser reordenadas na tela
+    bisect.insort(
+        state._leaves_by_person.setdefault(leave.personnel_id, []), leave, key=_start_key
+    )
+    bisect.insort(state._leaves_by_created, leave, key=_created_key)
+    starts, ends = leave_intervals(state, leave.type)
+    start, end = _leave_ordinals(leave)
+    i = int(np.searchsorted(starts, start, side="right"))
+    state._intervals_by_type[leave.type] = (
+        np.insert(starts, i, start), np.insert(ends, i, end)
+    )
+    state._leaves_version += 1
 
 
 # ==========================
 #  INTERFACE STREAMLIT
 # ==========================
 
-def page_dashboard(state: AppState):
-    st.header("📊 Visão geral (Dashboard simples)")
-
-    total = len(state.personnel)
-    em_ferias = 0
-    hoje = date.today().isoformat()
-
-    for l in state.leaves:
-        if l.type == LeaveType.FERIAS.value and l.startDate <= hoje <= l.endDate:
-            em_ferias += 1
-
-    col1, col2 = st.columns(2)
-    col1.metric("Total de militares cadastrados", total)
-    col2.metric("Militares em férias hoje", em_ferias)
+def count_on_leave(state: AppState, tipo: str, hoje: date) -> int:
+    # Só os afastamentos do tipo já iniciados são candidatos
+    starts, ends = leave_intervals(state, tipo)
+    hoje_ord = hoje.toordinal()
+    iniciados = np.searchsorted(starts, hoje_ord, side="right")
+    return int((ends[:iniciados] >= hoje_ord).sum())
 
-    st.write("---")
-    st.subheader("Últimos afastamentos lançados")
-    sorted_leaves = sorted(state.leaves, key=lambda x: x.createdAt, reverse=True)[:10]
 
+def recent_leave_rows(state: AppState, limit: int = 10) -> List[Dict[str, Any]]:
     rows = []
-    for l in sorted_leaves:
+    for l in reversed(state._leaves_by_created[-limit:]):  # mais recentes primeiro
         p = find_person_by_id(state, l.personnel_id)
         rows.append({
             "Militar": p.nome if p else "(desconhecido)",
@@ -170,6 +613,37 @@ def page_dashboard(state: AppState):
             "Fim": l.endDate,
             "Descrição": l.description,
         })
+    return rows
+
+
+def page_dashboard(state: AppState):
+    st.header("📊 Visão geral (Dashboard simples)")
+
+    total = len(state.personnel)
+    hoje = date.today()
+
+    # Reruns sem mudança nos dados reaproveitam os valores da sessão.
+    # A contagem depende dos afastamentos e do dia; a tabela, dos afastamentos
+    # e do efetivo (mostra nome e graduação).
+    key = (state._leaves_version, hoje)
+    cached = st.session_state.get("_dash_cache")
+    if cached is None or cached[0] != key:
+        cached = (key, count_on_leave(state, LeaveType.FERIAS.value, hoje))
+        st.session_state["_dash_cache"] = cached
+    em_ferias = cached[1]
+
+    sig = (state._leaves_version, state._personnel_version)
+    if st.session_state.get("_dash_rows_sig") != sig:
+        st.session_state["_dash_rows"] = recent_leave_rows(state)
+        st.session_state["_dash_rows_sig"] = sig
+    rows = st.session_state["_dash_rows"]
+
+    col1, col2 = st.columns(2)
+    col1.metric("Total de militares cadastrados", total)
+    col2.metric("Militares em férias hoje", em_ferias)
+
+    st.write("---")
+    st.subheader("Últimos afastamentos lançados")
 
     if rows:
         st.table(rows)
@@ -182,36 +656,16 @@ def page_personnel(state: AppState):
 
     # Filtro de busca
     search = st.text_input("Buscar por nome ou matrícula")
-    filtered = state.personnel
+    df = personnel_dataframe(state)
     if search:
-        search_lower = search.lower()
-        filtered = [
-            p for p in state.personnel
-            if search_lower in p.nome.lower() or search_lower in p.matr.lower()
-        ]
+        needle = search.casefold()
+        # _search_index segue a mesma ordem das linhas da tabela
+        mask = [needle in nome or needle in matr for _, nome, matr in state._search_index]
+        df = df[mask].reset_index(drop=True)
 
     st.subheader("Lista de militares")
-    if filtered:
-        st.dataframe(
-            [
-                {
-                    "ID": p.id,
-                    "Ant": p.ant,
-                    "Grad": p.grad,
-                    "Nome": p.nome,
-                    "Matr": p.matr,
-                    "Unid": p.unid,
-                    "Seção": p.secao,
-                    "Situação": p.situacao,
-                    "Escala": p.esc,
-                    "Saldo Férias": p.saldoFerias,
-                    "Saldo Abono": p.saldoAbono,
-                    "Perfil": p.role,
-                }
-                for p in filtered
-            ],
-            use_container_width=True,
-        )
+    if not df.empty:
+        st.dataframe(df, use_container_width=True)
     else:
         st.info("Nenhum militar encontrado com esse filtro.")
 
@@ -242,7 +696,7 @@ def page_personnel(state: AppState):
                 st.error("Nome e matrícula são obrigatórios.")
             else:
                 new = Personnel(
-                    id=generate_id("P", state.personnel),
+                    id=new_personnel_id(state),
                     ant=int(ant),
                     grad=grad,
                     quadro=quadro,
@@ -256,8 +710,8 @@ def page_personnel(state: AppState):
                     saldoAbono=int(saldo_abono),
                     role=role,
                 )
-                state.personnel.append(new)
-                save_state(state)
+                add_personnel(state, new)
+                request_save(state)
                 st.success(f"Militar {nome} cadastrado com sucesso!")
                 st.experimental_rerun()
 
@@ -269,13 +723,20 @@ def page_leaves(state: AppState):
         st.warning("Primeiro cadastre ao menos um militar na aba 'Efetivo'.")
         return
 
-    # Escolher militar
-    options = {
-        f"{p.nome} ({p.grad} - {p.matr})": p.id for p in state.personnel
-    }
-    label = st.selectbox("Selecione o militar", list(options.keys()))
-    selected_id = options[label]
-    person = find_person_by_id(state, selected_id)
+    # Escolher militar (rótulos e ids em listas paralelas, refeitos só quando
+    # o efetivo muda)
+    cached = st.session_state.get("_leave_options")
+    if cached is None or cached[0] != state._personnel_version:
+        labels = [f"{p.nome} ({p.grad} - {p.matr})" for p in state.personnel]
+        ids = [p.id for p in state.personnel]
+        cached = (state._personnel_version, labels, ids)
+        st.session_state["_leave_options"] = cached
+    _, labels, ids = cached
+
+    idx = st.selectbox(
+        "Selecione o militar", range(len(labels)), format_func=labels.__getitem__
+    )
+    person = find_person_by_id(state, ids[idx])
 
     st.subheader(f"Dados do militar selecionado")
     st.write(f"**Nome:** {person.nome}")
@@ -306,7 +767,7 @@ def page_leaves(state: AppState):
                 st.error("Data de término não pode ser anterior à data de início.")
             else:
                 new_leave = LeaveRecord(
-                    id=generate_id("L", state.leaves),
+                    id=new_leave_id(state),
                     personnel_id=person.id,
                     type=tipo,
                     startDate=start.isoformat(),
@@ -314,16 +775,28 @@ def page_leaves(state: AppState):
                     description=desc,
                     createdAt=datetime.now().isoformat(),
                 )
-                state.leaves.append(new_leave)
-
-                # Atualização simples de saldos (somente para FÉRIAS/ABONO)
+                add_leave(state, new_leave)
+                append_leave_record(new_leave)
+
+                # Atualização simples de saldos (somente para FÉRIAS/ABONO).
+                # O afastamento já está no disco; o saldo é gravado logo em
+                # seguida (sem esperar a thread), mas os dois arquivos não são
+                # gravados atomicamente: uma queda entre as gravações, ou uma
+                # falha ao gravar o saldo, deixa o afastamento sem o desconto.
                 days = (end - start).days + 1
-                if tipo == LeaveType.FERIAS.value:
-                    person.saldoFerias = max(0, person.saldoFerias - days)
-                if tipo == LeaveType.ABONO.value:
-                    person.saldoAbono = max(0, person.saldoAbono - days)
+                try:
+                    if tipo == LeaveType.FERIAS.value:
+                        person = debit_balance(state, person, "saldoFerias", days)
+                    if tipo == LeaveType.ABONO.value:
+                        person = debit_balance(state, person, "saldoAbono", days)
+                except OSError as e:
+                    request_save(state)  # nova tentativa em segundo plano
+                    st.error(
+                        "O afastamento foi lançado, mas o novo saldo não pôde ser "
+                        f"gravado ({e}). A gravação do saldo será tentada novamente."
+                    )
+                    return
 
-                save_state(state)
                 st.success("Afastamento lançado com sucesso!")
                 st.experimental_rerun()
 
@@ -339,7 +812,7 @@ def page_leaves(state: AppState):
                 "Fim": l.endDate,
                 "Descrição": l.description,
             }
-            for l in sorted(person_leaves, key=lambda x: x.startDate, reverse=True)
+            for l in reversed(person_leaves)
         ]
         st.table(rows)
     else:
@@ -363,7 +836,14 @@ def page_reports(state: AppState):
     st.write("---")
     st.subheader("Exportar dados brutos (JSON)")
     st.code(DATA_FILE.resolve().as_posix())
-    st.write("Você pode abrir esse arquivo com qualquer editor de texto ou usar em outro sistema.")
+    st.code(LEAVES_FILE.resolve().as_posix())
+    st.write("Você pode abrir esses arquivos com qualquer editor de texto ou usar em outro sistema.")
+    st.download_button(
+        "Baixar JSON completo",
+        data=export_state(state),
+        file_name="dados_efetivo_export.json",
+        mime="application/json",
+    )
 
 
 # ==========================
@@ -377,6 +857,13 @@ def main():
         initial_sidebar_state="expanded",
     )
 
+    saver = _state_saver()  # inicia a thread de gravação
+    if saver.last_error is not None:
+        st.error(
+            f"Não foi possível gravar os dados ({saver.last_error}). "
+            "As alterações continuam pendentes e a gravação será tentada novamente."
+        )
+
     # Carrega estado na sessão
     if "state" not in st.session_state:
         st.session_state.state = load_state()